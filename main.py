@@ -1,23 +1,26 @@
 import asyncio
-import base64
 import binascii
+import gzip
 import hashlib
 import ipaddress
-import json
 import os
 import re
 import socket
 from contextlib import asynccontextmanager
-from typing import Optional
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Union
 from urllib.parse import urljoin, urlparse
 
 import httpx
+import orjson
+import pybase64
+from cachetools import LRUCache
 from diskcache import Cache
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, ValidationError
 
 # ── Optional Cloudflare solver ─────────────────────────────────────────
 
@@ -38,7 +41,54 @@ M3U8_CONTENT_TYPES = {
 }
 
 
-URI_ATTR_RE = re.compile(r'URI="([^"]+)"')
+CONTENT_TYPES_BY_EXTENSION = {
+    "m3u8": "application/vnd.apple.mpegurl",
+    "ts": "video/mp2t",
+    "mp4": "video/mp4",
+    "vtt": "text/vtt",
+    "webvtt": "text/vtt",
+    "m4s": "video/iso.segment",
+}
+
+
+# Playlist classification runs inside the regex engine. Both patterns start
+# with a literal, which sre locates with a fast substring search, so tag and
+# blank lines never reach Python code. PLAYLIST_URL_LINE_RE matches a URL line
+# (anything not starting with '#') including its preceding newline.
+PLAYLIST_URL_LINE_RE = re.compile(rb"\n[ \t]*([^#\s][^\r\n]*)")
+URI_ATTR_RE = re.compile(rb'URI="([^"]+)"')
+
+
+RANGE_HEADER_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+ABSOLUTE_URL_PREFIXES = ("http://", "https://")
+
+
+IP_LITERAL_CHARS = frozenset("0123456789abcdef:.")
+
+
+# Characters that URL joining would percent-encode or treat as a scheme marker.
+RELATIVE_URL_SPECIAL_CHARS = frozenset(' "#:;<>`{}')
+
+
+# Lax boolean forms accepted for `src`, matching what pydantic's bool accepted
+# before ProxyData became a dataclass (client-built links rely on them).
+LAX_BOOL_STRINGS = {
+    "1": True,
+    "true": True,
+    "t": True,
+    "yes": True,
+    "y": True,
+    "on": True,
+    "0": False,
+    "false": False,
+    "f": False,
+    "no": False,
+    "n": False,
+    "off": False,
+}
+LAX_BOOL_NUMBERS = {0: False, 1: True}
 
 
 http_client: Optional[httpx.AsyncClient] = None
@@ -57,6 +107,27 @@ inflight_media_lock = asyncio.Lock()
 MAX_REDIRECTS = 5
 
 
+# Approximate bytes of Python objects per LRU entry besides the body.
+MEMORY_CACHE_ENTRY_OVERHEAD = 1024
+
+
+# Longest proxy path segment decode_proxy_data memoizes.
+DECODE_CACHE_MAX_INPUT = 2048
+
+
+GZIP_MIN_SIZE = 512
+GZIP_LEVEL = 5
+
+
+# Upstream validators/length forwarded only when the body is passed through as-is.
+UPSTREAM_ENTITY_HEADERS = (
+    "Last-Modified",
+    "ETag",
+    "Accept-Ranges",
+    "Content-Length",
+)
+
+
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
 
 
@@ -168,7 +239,8 @@ class CFSolver:
 cf_solver = CFSolver()
 
 
-class ProxyData(BaseModel):
+@dataclass(slots=True, frozen=True)
+class ProxyData:
     url: str
     origin: Optional[str] = None
     referer: Optional[str] = None
@@ -189,24 +261,43 @@ class MediaFlight:
         self.total_size: Optional[int] = None  # for range requests on in-flight streams
 
 
-def model_to_dict(model: BaseModel) -> dict:
-    if hasattr(model, "model_dump"):
-        return model.model_dump(exclude_none=True)
-    return model.dict(exclude_none=True)
-
-
 def is_absolute_url(url: str) -> bool:
-    return url.startswith(("http://", "https://"))
+    return url.startswith(ABSOLUTE_URL_PREFIXES)
 
 
-def resolve_url(base_url: str, relative_url: str) -> str:
+def resolve_url(base_url: Union[str, httpx.URL], relative_url: str) -> str:
+    """Resolve against base_url; pass a pre-parsed httpx.URL when resolving many."""
     try:
         if is_absolute_url(relative_url):
             return relative_url
-        base = httpx.URL(base_url)
+        base = base_url if isinstance(base_url, httpx.URL) else httpx.URL(base_url)
         return str(base.join(relative_url))
     except Exception:
-        return urljoin(base_url, relative_url)
+        return urljoin(str(base_url), relative_url)
+
+
+def looks_like_ip_literal(hostname: str) -> bool:
+    if hostname.startswith("["):
+        hostname = hostname[1:]
+    if hostname.endswith("]"):
+        hostname = hostname[:-1]
+    return bool(hostname) and IP_LITERAL_CHARS.issuperset(hostname)
+
+
+def is_sibling_relative_url(relative_url: str) -> bool:
+    """True for plain same-directory references that resolve by concatenation."""
+    path, has_query, query = relative_url.partition("?")
+    return (
+        bool(path)
+        and relative_url.isascii()
+        and relative_url.isprintable()
+        and not path.startswith(("/", "."))
+        and not path.endswith(("/.", "/.."))
+        and "./" not in path
+        and "//" not in path
+        and not (has_query and not query)
+        and RELATIVE_URL_SPECIAL_CHARS.isdisjoint(relative_url)
+    )
 
 
 def is_ip_blocked(ip: ipaddress._BaseAddress) -> bool:
@@ -229,7 +320,7 @@ def is_safe_url_syntax(url: str) -> bool:
             return False
         if hostname.endswith(".localhost"):
             return False
-        if "." not in hostname and not re.match(r"^\[?[0-9a-f:.]+\]?$", hostname):
+        if "." not in hostname and not looks_like_ip_literal(hostname):
             return False
         try:
             ip = ipaddress.ip_address(hostname)
@@ -278,114 +369,159 @@ async def assert_safe_url(url: str) -> None:
         raise HTTPException(status_code=403, detail="Host resolved to no IPs.")
 
 
+def url_extension(url: str) -> str:
+    path = url.split("?", 1)[0].split("#", 1)[0]
+    return path.rpartition(".")[2].lower()
+
+
 def determine_content_type(url: str, response_content_type: str) -> str:
-    url_lower = url.lower()
-    upstream_ct = (response_content_type or "").split(";", 1)[0].strip().lower()
-    if ".m3u8" in url_lower:
+    content_type = CONTENT_TYPES_BY_EXTENSION.get(url_extension(url))
+    if content_type:
+        return content_type
+    # Playlists behind a path suffix, e.g. .../master.m3u8/token.
+    if ".m3u8" in url.lower():
         return "application/vnd.apple.mpegurl"
-    if ".ts" in url_lower:
-        return "video/mp2t"
-    if ".mp4" in url_lower:
-        return "video/mp4"
-    if ".webvtt" in url_lower or ".vtt" in url_lower:
-        return "text/vtt"
-    if ".m4s" in url_lower:
-        return "video/iso.segment"
+    upstream_ct = (response_content_type or "").split(";", 1)[0].strip().lower()
     if upstream_ct:
         return upstream_ct
     return "application/octet-stream"
 
 
-def build_cache_key(data: ProxyData) -> str:
-    canonical = json.dumps(
-        {
-            "url": data.url,
-            "origin": data.origin,
-            "referer": data.referer,
-            "src": data.src,
-        },
-        sort_keys=True,
-        separators=(",", ":"),
-    )
-    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+def build_cache_key(data: ProxyData, route: str) -> str:
+    # Keyed on what is fetched upstream, not on how it is rewritten: cached
+    # values are raw upstream bodies, so `src` and the server origin stay out.
+    # `route` keeps playlist and media entries apart since they are cached
+    # under different rules (live detection vs. immutable segments).
+    canonical = orjson.dumps([route, data.url, data.origin, data.referer])
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
 
 
-def encode_proxy_data(data: ProxyData) -> str:
-    payload = json.dumps(
-        model_to_dict(data),
-        sort_keys=True,
-        separators=(",", ":"),
-    )
-    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("utf-8").rstrip("=")
+def encode_proxy_data(payload: dict) -> bytes:
+    serialized = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    return pybase64.urlsafe_b64encode(serialized).rstrip(b"=")
 
 
 def build_proxied_url(
     absolute_url: str,
     original_data: ProxyData,
-    server_origin: str,
-) -> str:
+    url_prefix: bytes,
+) -> bytes:
     is_playlist = ".m3u8" in absolute_url.lower()
-    new_proxy_data = ProxyData(
-        url=absolute_url,
-        origin=original_data.origin,
-        referer=original_data.referer,
-        src=is_playlist,
-    )
-    encoded = encode_proxy_data(new_proxy_data)
-    proxied_url = f"{server_origin}/url/{encoded}"
+    # Built as a plain dict: the data is trusted, so skip model validation
+    # for every rewritten line.
+    payload = {"url": absolute_url, "src": is_playlist}
+    if original_data.origin is not None:
+        payload["origin"] = original_data.origin
+    if original_data.referer is not None:
+        payload["referer"] = original_data.referer
+    encoded = encode_proxy_data(payload)
     if is_playlist:
-        proxied_url += ".m3u8"
-    return proxied_url
+        return url_prefix + encoded + b".m3u8"
+    return url_prefix + encoded
 
 
-def rewrite_uri_attributes(
-    line: str,
-    base_url: str,
+def rewrite_m3u8_urls(
+    content: bytes,
     original_data: ProxyData,
     server_origin: str,
-) -> str:
-    def _replace(match: re.Match) -> str:
-        raw_uri = match.group(1)
-        absolute_url = resolve_url(base_url, raw_uri)
-        proxied_url = build_proxied_url(absolute_url, original_data, server_origin)
-        return f'URI="{proxied_url}"'
-
-    return URI_ATTR_RE.sub(_replace, line)
+) -> bytes:
+    """Rewrite playlist URLs to go through the proxy.
 
+    M3U8 is UTF-8 (in practice ASCII), so the body is processed as bytes and
+    only the URLs themselves are decoded.
+    """
+    try:
+        base_url: Union[str, httpx.URL] = httpx.URL(original_data.url)
+        # Most segments are siblings of the playlist; join those by concatenation.
+        base_dir: Optional[str] = str(base_url.join("./"))
+    except Exception:
+        base_url = original_data.url
+        base_dir = None
+    url_prefix = (server_origin + "/url/").encode("utf-8")
 
-def rewrite_m3u8_urls(
-    content: str,
-    original_data: ProxyData,
-    server_origin: str,
-) -> str:
-    base_url = original_data.url
-    lines = content.splitlines()
-    rewritten_lines = []
-
-    for line in lines:
-        stripped = line.strip()
-        if not stripped:
-            rewritten_lines.append(line)
-            continue
+    def _proxy(relative_url: str) -> bytes:
+        if is_absolute_url(relative_url):
+            absolute_url = relative_url
+        elif base_dir is not None and is_sibling_relative_url(relative_url):
+            absolute_url = base_dir + relative_url
+        else:
+            absolute_url = resolve_url(base_url, relative_url)
+        return build_proxied_url(absolute_url, original_data, url_prefix)
 
-        if stripped.startswith("#"):
-            rewritten_lines.append(
-                rewrite_uri_attributes(line, base_url, original_data, server_origin)
-            )
-            continue
+    def _replace_line(match: re.Match) -> bytes:
+        url_line = match.group(1).rstrip()
+        try:
+            return b"\n" + _proxy(url_line.decode("utf-8", errors="replace"))
+        except Exception as e:
+            print(f"Error rewriting URL {url_line!r}: {e}")
+            return match.group(0)
 
+    def _replace_attr(match: re.Match) -> bytes:
+        raw_uri = match.group(1).decode("utf-8", errors="replace")
         try:
-            absolute_url = resolve_url(base_url, stripped)
-            proxied_url = build_proxied_url(absolute_url, original_data, server_origin)
-            rewritten_lines.append(proxied_url)
+            return b'URI="' + _proxy(raw_uri) + b'"'
         except Exception as e:
-            print(f"Error rewriting URL '{stripped}': {e}")
-            rewritten_lines.append(line)
+            print(f"Error rewriting URI attribute {raw_uri!r}: {e}")
+            return match.group(0)
+
+    # Prefix a newline so the first line is matched like the rest. URL lines
+    # are rewritten first; proxied URLs never contain URI=", so the attribute
+    # pass only sees tag lines.
+    rewritten = PLAYLIST_URL_LINE_RE.sub(_replace_line, b"\n" + content)
+    rewritten = URI_ATTR_RE.sub(_replace_attr, rewritten)
+    return rewritten[1:]
 
-    return "\n".join(rewritten_lines) + ("\n" if content.endswith("\n") else "")
+
+def parse_lax_bool(value) -> Optional[bool]:
+    if isinstance(value, str):
+        return LAX_BOOL_STRINGS.get(value.lower())
+    if isinstance(value, (bool, int, float)):
+        return LAX_BOOL_NUMBERS.get(value)
+    return None
+
+
+def proxy_data_from_json(json_data) -> ProxyData:
+    """Validate a decoded payload; unknown keys are ignored."""
+    if not isinstance(json_data, dict):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid proxy data format: expected a JSON object",
+        )
+    url = json_data.get("url")
+    if not isinstance(url, str):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid proxy data format: 'url' must be a string",
+        )
+    for field in ("origin", "referer"):
+        value = json_data.get(field)
+        if value is not None and not isinstance(value, str):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid proxy data format: '{field}' must be a string",
+            )
+    src = parse_lax_bool(json_data.get("src", False))
+    if src is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid proxy data format: 'src' must be a boolean",
+        )
+    return ProxyData(
+        url=url,
+        origin=json_data.get("origin"),
+        referer=json_data.get("referer"),
+        src=src,
+    )
 
 
 def decode_proxy_data(base64_data: str) -> ProxyData:
+    # Only short segments are memoized, so cache keys stay bounded in size.
+    if len(base64_data) <= DECODE_CACHE_MAX_INPUT:
+        return _decode_proxy_data_cached(base64_data)
+    return _decode_proxy_data(base64_data)
+
+
+def _decode_proxy_data(base64_data: str) -> ProxyData:
     try:
         # Strip .m3u8 suffix first
         if base64_data.endswith(".m3u8"):
@@ -395,12 +531,11 @@ def decode_proxy_data(base64_data: str) -> ProxyData:
         base64_data = base64_data.rstrip("/ \t\r\n")
 
         # Re-add base64 padding that was stripped on encode
-        padding_needed = (4 - len(base64_data) % 4) % 4
-        base64_data += "=" * padding_needed
-
-        decoded_bytes = base64.urlsafe_b64decode(base64_data)
-        json_data = json.loads(decoded_bytes.decode("utf-8"))
-        data = ProxyData(**json_data)
+        decoded_bytes = pybase64.urlsafe_b64decode(
+            base64_data + "=" * (-len(base64_data) % 4)
+        )
+        json_data = orjson.loads(decoded_bytes)
+        data = proxy_data_from_json(json_data)
 
         if not is_safe_url_syntax(data.url):
             raise HTTPException(
@@ -412,12 +547,19 @@ def decode_proxy_data(base64_data: str) -> ProxyData:
 
     except HTTPException:
         raise
+    # JSON errors subclass ValueError, so match them first.
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON in proxy data: {e}")
     except (binascii.Error, ValueError) as e:
         raise HTTPException(status_code=400, detail=f"Invalid base64 encoding: {e}")
-    except (json.JSONDecodeError, UnicodeDecodeError) as e:
-        raise HTTPException(status_code=400, detail=f"Invalid JSON in proxy data: {e}")
-    except ValidationError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid proxy data format: {e}")
+
+
+# Pure function of the path segment; hot segments skip base64/JSON/validation.
+# Failures raise, so only successful decodes are cached. ProxyData is frozen,
+# so sharing instances between requests is safe.
+@lru_cache(maxsize=4096)
+def _decode_proxy_data_cached(base64_data: str) -> ProxyData:
+    return _decode_proxy_data(base64_data)
 
 
 def get_server_origin(request: Request) -> str:
@@ -550,7 +692,7 @@ async def safe_stream_get(url: str, headers: dict) -> httpx.Response:
 def parse_single_range(range_header: str, total_size: int) -> Optional[tuple[int, int]]:
     if not range_header:
         return None
-    match = re.match(r"^bytes=(\d*)-(\d*)$", range_header.strip())
+    match = RANGE_HEADER_RE.match(range_header.strip())
     if not match:
         return None
     start_text, end_text = match.groups()
@@ -622,6 +764,20 @@ def cached_range_response(
     )
 
 
+def slice_chunks(chunks: list[bytes], start: int, end: int) -> bytes:
+    """Return bytes start..end (inclusive) without joining the whole body."""
+    parts = []
+    offset = 0
+    for chunk in chunks:
+        chunk_end = offset + len(chunk)
+        if chunk_end > start:
+            parts.append(chunk[max(start - offset, 0) : end + 1 - offset])
+        if chunk_end > end:
+            break
+        offset = chunk_end
+    return b"".join(parts)
+
+
 def is_cacheable_full_media_response(status_code: int, request: Request) -> bool:
     if request.headers.get("range"):
         return False
@@ -646,7 +802,12 @@ def build_downstream_media_headers(upstream: httpx.Response) -> dict:
     return headers
 
 
-async def fetch_upstream_result(proxy_data: ProxyData, request: Request):
+def is_m3u8_response(content_type: str) -> bool:
+    # determine_content_type already maps any ".m3u8" URL to the playlist type.
+    return content_type in M3U8_CONTENT_TYPES
+
+
+async def fetch_upstream_result(proxy_data: ProxyData):
     request_headers = build_upstream_headers(proxy_data, request=None)
     try:
         upstream = await safe_get(proxy_data.url, headers=request_headers)
@@ -674,8 +835,7 @@ async def fetch_upstream_result(proxy_data: ProxyData, request: Request):
         upstream.headers.get("content-type", ""),
     )
 
-    is_m3u8 = ".m3u8" in proxy_data.url.lower() or content_type in M3U8_CONTENT_TYPES
-    will_modify = proxy_data.src and is_m3u8
+    content = upstream.content
     is_live_playlist = False
 
     response_headers = {
@@ -683,32 +843,21 @@ async def fetch_upstream_result(proxy_data: ProxyData, request: Request):
         "Access-Control-Expose-Headers": "*",
     }
 
-    if is_m3u8:
-        content = upstream.text
-        if will_modify:
-            content = rewrite_m3u8_urls(
-                content,
-                proxy_data,
-                get_server_origin(request),
-            )
-        if "#EXT-X-ENDLIST" not in content:
+    if is_m3u8_response(content_type):
+        if b"#EXT-X-ENDLIST" not in content:
             is_live_playlist = True
-            response_headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+            # Revalidate on every poll (no-store would suppress If-None-Match).
+            response_headers["Cache-Control"] = "no-cache, must-revalidate"
         else:
             response_headers["Cache-Control"] = "public, max-age=3600"
     else:
-        content = upstream.content
         response_headers["Cache-Control"] = "public, max-age=3600, immutable"
 
-    if not will_modify:
-        for header in (
-            "Last-Modified",
-            "ETag",
-            "Accept-Ranges",
-            "Content-Length",
-        ):
-            if header in upstream.headers:
-                response_headers[header] = upstream.headers[header]
+    for header in UPSTREAM_ENTITY_HEADERS:
+        if header in upstream.headers:
+            response_headers[header] = upstream.headers[header]
+    # Stored with the entry so conditional requests never need the body.
+    response_headers.setdefault("ETag", compute_etag(content))
 
     result = (
         content,
@@ -719,45 +868,204 @@ async def fetch_upstream_result(proxy_data: ProxyData, request: Request):
     return result, is_live_playlist
 
 
+def cached_result_size(value: tuple) -> int:
+    # Body plus a flat charge for the tuple, headers dict and key.
+    return len(value[0]) + MEMORY_CACHE_ENTRY_OVERHEAD
+
+
+def memory_cache_set(cache_key: str, value: tuple) -> None:
+    try:
+        memory_cache[cache_key] = value
+    except ValueError:
+        # Larger than the whole in-memory budget; leave it to diskcache.
+        pass
+
+
+async def cache_get(cache_key: str) -> Optional[tuple]:
+    """Read-through: in-process LRU first, then diskcache."""
+    value = memory_cache.get(cache_key)
+    if value is not None:
+        return value
+    value = await run_in_threadpool(cache.get, cache_key)
+    if value is not None:
+        memory_cache_set(cache_key, value)
+    return value
+
+
+async def cache_set(cache_key: str, value: tuple) -> None:
+    memory_cache_set(cache_key, value)
+    await run_in_threadpool(cache.set, cache_key, value)
+
+
 async def fetch_cache_and_store(
     cache_key: str,
     proxy_data: ProxyData,
-    request: Request,
 ):
-    result, is_live_playlist = await fetch_upstream_result(proxy_data, request)
+    result, is_live_playlist = await fetch_upstream_result(proxy_data)
     if not is_live_playlist:
-        await run_in_threadpool(cache.set, cache_key, result)
+        await cache_set(cache_key, result)
     return result
 
 
 async def get_or_build_response(
     cache_key: str,
     proxy_data: ProxyData,
-    request: Request,
 ):
-    cached_value = await run_in_threadpool(cache.get, cache_key)
+    cached_value = await cache_get(cache_key)
     if cached_value is not None:
         return cached_value
 
     async with inflight_lock:
-        cached_value = await run_in_threadpool(cache.get, cache_key)
+        cached_value = await cache_get(cache_key)
         if cached_value is not None:
             return cached_value
 
         task = inflight_requests.get(cache_key)
         if task is None:
             task = asyncio.create_task(
-                fetch_cache_and_store(cache_key, proxy_data, request)
+                fetch_cache_and_store(cache_key, proxy_data)
             )
             inflight_requests[cache_key] = task
 
-        try:
-            return await task
-        finally:
-            if task.done():
-                async with inflight_lock:
-                    if inflight_requests.get(cache_key) is task:
-                        inflight_requests.pop(cache_key, None)
+    # Await outside the lock: other keys must not wait on this fetch, and the
+    # cleanup below takes the (non-reentrant) lock again.
+    try:
+        return await task
+    finally:
+        if task.done():
+            async with inflight_lock:
+                if inflight_requests.get(cache_key) is task:
+                    inflight_requests.pop(cache_key, None)
+
+
+def is_compressible_content_type(content_type: str) -> bool:
+    return content_type in M3U8_CONTENT_TYPES or content_type.startswith("text/")
+
+
+def should_gzip(content_type: str, request: Request) -> bool:
+    """Whether a playlist-route text body may be sent gzipped to this client."""
+    return is_compressible_content_type(content_type) and "gzip" in request.headers.get(
+        "accept-encoding", ""
+    )
+
+
+def gzip_etag(etag: str) -> str:
+    # Strong validators must differ between content codings (RFC 9110 8.8.3);
+    # like nginx, weaken the tag instead of minting a new one.
+    if etag.startswith("W/"):
+        return etag
+    return "W/" + etag
+
+
+def gzip_response_body(content: bytes, response_headers: dict) -> tuple[bytes, dict]:
+    headers = dict(response_headers)
+    headers.pop("Content-Length", None)
+    headers["Content-Encoding"] = "gzip"
+    return gzip.compress(content, compresslevel=GZIP_LEVEL), headers
+
+
+def compute_etag(content: bytes) -> str:
+    return '"' + hashlib.blake2b(content, digest_size=8).hexdigest() + '"'
+
+
+def derive_etag(etag: str, *parts: str) -> str:
+    """ETag for a representation derived from `etag`'s body (keeps weakness)."""
+    weak = etag.startswith("W/")
+    digest = hashlib.blake2b(
+        "\n".join((etag, *parts)).encode("utf-8"),
+        digest_size=8,
+    ).hexdigest()
+    return ("W/" if weak else "") + '"' + digest + '"'
+
+
+def etag_opaque(etag: str) -> str:
+    """Opaque tag for weak comparison (RFC 9110 8.8.3.2)."""
+    return etag.strip().removeprefix("W/")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag_opaque(etag)
+    return any(
+        etag_opaque(candidate) == opaque for candidate in if_none_match.split(",")
+    )
+
+
+def not_modified_response(
+    request: Request,
+    response_headers: dict,
+) -> Optional[Response]:
+    """Return a bare 304 when the client's If-None-Match matches our ETag."""
+    etag = response_headers.get("ETag")
+    if_none_match = request.headers.get("if-none-match")
+    if not etag or not if_none_match or not etag_matches(if_none_match, etag):
+        return None
+    headers = {
+        k: v
+        for k, v in response_headers.items()
+        if k not in ("Content-Length", "Content-Range", "Content-Encoding")
+    }
+    return Response(status_code=304, headers=headers)
+
+
+def build_playlist_response(
+    cached_result: tuple,
+    proxy_data: ProxyData,
+    request: Request,
+) -> Response:
+    """Rewrite a cached upstream body for this request's server origin.
+
+    Conditional requests are answered from the stored ETag before any
+    rewriting happens.
+    """
+    content, content_type, response_headers, status_code = cached_result
+    raw_etag = response_headers.get("ETag") or compute_etag(content)
+    will_rewrite = proxy_data.src and is_m3u8_response(content_type)
+    if will_rewrite:
+        server_origin = get_server_origin(request)
+        response_headers = {
+            k: v
+            for k, v in response_headers.items()
+            if k not in UPSTREAM_ENTITY_HEADERS
+        }
+        # The rewritten body is a function of the raw body and these inputs.
+        response_headers["ETag"] = derive_etag(
+            raw_etag,
+            server_origin,
+            proxy_data.url,
+            proxy_data.origin or "",
+            proxy_data.referer or "",
+        )
+    else:
+        response_headers = dict(response_headers)
+        response_headers.setdefault("ETag", raw_etag)
+
+    # Decided before rewriting so a 304 carries the same ETag variant the full
+    # response would. Rewritten playlists always qualify on size (every URL
+    # grows by the proxy prefix and payload); pass-through bodies are checked.
+    use_gzip = should_gzip(content_type, request) and (
+        will_rewrite or len(content) >= GZIP_MIN_SIZE
+    )
+    if is_compressible_content_type(content_type):
+        response_headers["Vary"] = "Accept-Encoding"
+    if use_gzip:
+        response_headers["ETag"] = gzip_etag(response_headers["ETag"])
+
+    not_modified = not_modified_response(request, response_headers)
+    if not_modified is not None:
+        return not_modified
+
+    if will_rewrite:
+        content = rewrite_m3u8_urls(content, proxy_data, server_origin)
+    if use_gzip:
+        content, response_headers = gzip_response_body(content, response_headers)
+    return Response(
+        content=content,
+        status_code=status_code,
+        media_type=content_type,
+        headers=response_headers,
+    )
 
 
 async def produce_media_flight(
@@ -817,7 +1125,7 @@ async def produce_media_flight(
                 cached_headers,
                 flight.status_code,
             )
-            await run_in_threadpool(cache.set, cache_key, cached_result)
+            await cache_set(cache_key, cached_result)
 
     except BaseException as e:
         flight.error = e
@@ -857,15 +1165,19 @@ async def stream_media_with_shared_cache(
     proxy_data: ProxyData,
     request: Request,
 ):
-    """Serve media segments. Checks diskcache first; falls back to shared
+    """Serve media segments. Checks the cache first; falls back to shared
     in-flight download (which caches on completion). Supports both full and
     range requests for cached content."""
 
-    # ── 1. Try diskcache (full object) ────────────────────────────────
-    cached_value = await run_in_threadpool(cache.get, cache_key)
+    # ── 1. Try cache (full object) ────────────────────────────────────
+    cached_value = await cache_get(cache_key)
     if cached_value is not None:
         content, content_type, response_headers, status_code = cached_value
 
+        not_modified = not_modified_response(request, response_headers)
+        if not_modified is not None:
+            return not_modified
+
         # Serve range from cached full body
         range_header = request.headers.get("range")
         if range_header:
@@ -915,13 +1227,13 @@ async def stream_media_with_shared_cache(
         if flight.error:
             raise flight.error
 
-        total_size = len(b"".join(flight.chunks))
+        total_size = sum(len(chunk) for chunk in flight.chunks)
         parsed = parse_single_range(range_header, total_size)
         if parsed is None:
             return make_416_response(total_size)
 
         start, end = parsed
-        body = b"".join(flight.chunks)[start : end + 1]
+        body = slice_chunks(flight.chunks, start, end)
         headers = dict(flight.response_headers)
         headers.pop("Content-Length", None)
         headers.pop("Content-Range", None)
@@ -955,6 +1267,12 @@ async def stream_media_with_shared_cache(
 cache_size_gb = float(os.getenv("CACHE_SIZE", "0.4"))
 cache_size_bytes = int(cache_size_gb * 1024 * 1024 * 1024)
 cache_dir = os.getenv("CACHE_DIR", "/tmp/m3u8_cache")
+memory_cache_size_gb = float(os.getenv("MEMORY_CACHE_SIZE", "0.1"))
+memory_cache_size_bytes = int(memory_cache_size_gb * 1024 * 1024 * 1024)
+
+http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "500"))
+http_max_keepalive = int(os.getenv("HTTP_MAX_KEEPALIVE", "100"))
+http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
 
 
 @asynccontextmanager
@@ -965,8 +1283,9 @@ async def lifespan(app: FastAPI):
         follow_redirects=False,
         timeout=30.0,
         limits=httpx.Limits(
-            max_connections=500,
-            max_keepalive_connections=100,
+            max_connections=http_max_connections,
+            max_keepalive_connections=http_max_keepalive,
+            keepalive_expiry=http_keepalive_expiry,
         ),
     )
 
@@ -1006,30 +1325,28 @@ cache = Cache(
 )
 
 
+# Per-process hot tier in front of diskcache: hits skip pickling and the
+# threadpool hop. Values are stored as-is, sized by body length.
+memory_cache = LRUCache(
+    maxsize=memory_cache_size_bytes,
+    getsizeof=cached_result_size,
+)
+
+
 @app.get("/url/{base64_data:path}")
 async def m3u8_proxy(base64_data: str, request: Request):
     proxy_data = decode_proxy_data(base64_data)
     await assert_safe_url(proxy_data.url)
-    cache_key = build_cache_key(proxy_data)
 
     # Playlists (.m3u8) — always served without range logic
     if is_probably_playlist(proxy_data):
-        content, content_type, response_headers, status_code = (
-            await get_or_build_response(
-                cache_key,
-                proxy_data,
-                request,
-            )
-        )
-        return Response(
-            content=content,
-            status_code=status_code,
-            media_type=content_type,
-            headers=response_headers,
-        )
+        cache_key = build_cache_key(proxy_data, "playlist")
+        cached_result = await get_or_build_response(cache_key, proxy_data)
+        return build_playlist_response(cached_result, proxy_data, request)
 
     # All media segments (.ts, .m4s, .mp4, etc.) — route through shared cache.
     # Handles full requests and range requests on both cached and in-flight streams.
+    cache_key = build_cache_key(proxy_data, "media")
     return await stream_media_with_shared_cache(
         cache_key,
         proxy_data,
@@ -1064,5 +1381,24 @@ def read_root():
             "max_bytes": size_limit,
             "max_gb": cache_size_gb,
             "utilization_percent": utilization,
+            "memory": {
+                "entries": len(memory_cache),
+                "current_bytes": memory_cache.currsize,
+                "max_bytes": memory_cache.maxsize,
+            },
         },
     }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools come with `uvicorn[standard]`.
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="uvloop",
+        http="httptools",
+    )